@@ -4,15 +4,285 @@ Fetch geofragmentation data from various sources
 Runs via GitHub Actions to update static data files
 """
 
-import json
+import gzip
+import hashlib
 import os
-from datetime import datetime, timedelta
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlencode
+import ijson
+import msgspec
 import requests
-import pandas as pd
+from requests.adapters import HTTPAdapter
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:  # Fall back to the stdlib encoder
+    orjson = None
+    import json
 
 # Create data directory if not exists
 os.makedirs('data', exist_ok=True)
 
+# Shared HTTP session: keeps connections alive across calls to the same host
+# and retries connection errors and 5xx responses (raising RetryError once
+# they run out)
+SESSION = requests.Session()
+adapter = HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504))
+)
+SESSION.mount('https://', adapter)
+
+# Ask for compressed bodies; Brotli only when urllib3 can decode it
+try:
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = 'gzip, br'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip'
+SESSION.headers.update({'Accept-Encoding': ACCEPT_ENCODING, 'Accept': 'application/json'})
+
+def dump_json(obj, indent=False):
+    """Serialize obj to JSON bytes, using orjson when available"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    if indent:
+        return json.dumps(obj, indent=2).encode()
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+def load_json(data):
+    """Parse JSON from bytes or str, using orjson when available"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def atomic_write(path, content):
+    """Write bytes via a temp file so readers never see a partial file.
+    Paths ending in .gz are gzip-compressed."""
+    if path.endswith('.gz'):
+        # Fixed mtime keeps the output byte-identical when the data is unchanged
+        content = gzip.compress(content, compresslevel=6, mtime=0)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+def atomic_write_json(path, obj, indent=False):
+    """Atomically write obj as a JSON document"""
+    atomic_write(path, dump_json(obj, indent=indent))
+
+def atomic_write_jsonl(path, records):
+    """Atomically write records as JSON lines, one record per line"""
+    atomic_write(path, b''.join(dump_json(record) + b'\n' for record in records))
+
+# On-disk response cache, persisted between workflow runs
+CACHE_DIR = '.cache'
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+# Cache lifetimes per source (seconds)
+WORLD_BANK_TTL = 7 * 24 * 3600  # Annual series, rarely revised
+IMF_TTL = 24 * 3600
+FRED_TTL = 6 * 3600
+
+def parse_json_response(response):
+    """Parse a whole JSON response body"""
+    return load_json(response.content)
+
+class WorldBankCountry(msgspec.Struct):
+    id: str
+    value: str
+
+class WorldBankObservation(msgspec.Struct):
+    country: WorldBankCountry
+    date: str
+    value: float | None = None
+    countryiso3code: str = ''
+
+# Responses are [page_info, observations], or just [error_message]
+WORLD_BANK_DECODER = msgspec.json.Decoder(list[dict | list[WorldBankObservation]])
+
+def parse_world_bank_observations(response):
+    """Decode World Bank observations into country names and compact records"""
+    result = WORLD_BANK_DECODER.decode(response.content)
+    if len(result) < 2:
+        # Errors come back as HTTP 200 with [{"message": [{"key": ..., "value": ...}]}]
+        error = result[0] if result and isinstance(result[0], dict) else {}
+        details = '; '.join(
+            str(m.get('value', '')) for m in error.get('message') or [] if isinstance(m, dict)
+        )
+        raise ValueError(f"World Bank error: {details or 'no observations'}")
+    
+    names = {}
+    records = []
+    for obs in result[1]:
+        country_code = obs.countryiso3code or obs.country.id
+        names[country_code] = obs.country.value
+        if obs.value is not None:
+            records.append({'c': country_code, 'd': obs.date, 'v': obs.value})
+    return {'names': names, 'records': records}
+
+def iter_fred_observations(response):
+    """Yield FRED observations incrementally as the response body arrives"""
+    # Push chunks from iter_content rather than reading response.raw, so
+    # dropped or stalled connections surface as requests exceptions
+    observations = ijson.sendable_list()
+    parser = ijson.items_coro(observations, 'observations.item')
+    for chunk in response.iter_content(chunk_size=64 * 1024):
+        parser.send(chunk)
+        yield from observations
+        del observations[:]
+    parser.close()
+    yield from observations
+
+def parse_fred_observations(response):
+    """Stream FRED observations, keeping only the date and reported value"""
+    return [
+        {'d': obs['date'], 'v': obs['value']}
+        for obs in iter_fred_observations(response)
+        if obs.get('value') not in (None, '.')
+    ]
+
+def is_rate_limited(error):
+    """Whether an error is an HTTP 429 rate-limit response"""
+    response = getattr(error, 'response', None)
+    return (
+        isinstance(error, requests.HTTPError)
+        and response is not None
+        and response.status_code == 429
+    )
+
+# Retry policy for rate-limited APIs: backs off on 429s only. 5xx responses
+# and connection errors are already retried by the session adapter.
+retry_rate_limited = retry(
+    stop=stop_after_attempt(4),
+    wait=wait_exponential_jitter(1, 10),
+    retry=retry_if_exception(is_rate_limited),
+    reraise=True
+)
+
+def describe_error(error):
+    """Summarize a fetch error without echoing the request URL, which may carry an api_key"""
+    if isinstance(error, requests.RequestException):
+        if error.response is not None:
+            return f"{type(error).__name__} (HTTP {error.response.status_code})"
+        return type(error).__name__
+    return f"{type(error).__name__}: {error}"
+
+def cached_get(url, ttl_seconds, params=None, parse=parse_json_response, stream=False, retry_policy=None):
+    """Fetch a JSON endpoint through the on-disk cache, serving stale data if the fetch fails"""
+    # Entries hold parsed bodies, so the parser is part of the key
+    request_id = f"{url}?{urlencode(sorted((params or {}).items()))}#{parse.__name__}"
+    key = hashlib.sha256(request_id.encode()).hexdigest()
+    path = os.path.join(CACHE_DIR, f"{key}.json")
+    
+    cached = None
+    if os.path.exists(path):
+        try:
+            with open(path, 'rb') as f:
+                cached = load_json(f.read())
+        except (OSError, ValueError):
+            cached = None
+        # Age comes from the stored timestamp, which survives cache restores
+        # that don't preserve file mtimes
+        if cached is not None and time.time() - cached.get('ts', 0) < ttl_seconds:
+            return cached['body']
+    
+    # Revalidate with the server so unchanged data comes back as an empty 304
+    headers = {}
+    if cached is not None:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+    
+    def request():
+        with SESSION.get(url, params=params, headers=headers, timeout=30, stream=stream) as response:
+            if response.status_code == 304 and cached is not None:
+                return None
+            # Only a full 200 body is parsed and cached
+            if response.status_code != 200:
+                raise requests.HTTPError(f"HTTP {response.status_code} for {url}", response=response)
+            body = parse(response)
+            # An empty body is an upstream error, never a cacheable result
+            if body is None:
+                raise ValueError("empty response body")
+            return body, response.headers.get('ETag'), response.headers.get('Last-Modified')
+    
+    if retry_policy is not None:
+        request = retry_policy(request)
+    
+    try:
+        fresh = request()
+    except (requests.RequestException, ValueError, ijson.JSONError) as e:
+        if cached is not None:
+            print(f"Fetch failed, serving stale cache for {url}: {describe_error(e)}")
+            return cached['body']
+        print(f"Fetch failed for {url}: {describe_error(e)}")
+        return None
+    
+    if fresh is None:
+        # Not modified: refresh the entry so the TTL starts over
+        cached['ts'] = time.time()
+        atomic_write_json(path, cached)
+        return cached['body']
+    
+    body, etag, last_modified = fresh
+    atomic_write_json(path, {
+        'body': body,
+        'etag': etag,
+        'last_modified': last_modified,
+        'ts': time.time()
+    })
+    return body
+
+# Static but periodically updated
+TRADE_AGREEMENTS = {
+    'USMCA': ['USA', 'CAN', 'MEX'],
+    'EU': ['DEU', 'FRA', 'ITA', 'ESP', 'NLD', 'POL', 'BEL', 'GRC', 'PRT', 'CZE'],
+    'RCEP': ['CHN', 'JPN', 'KOR', 'AUS', 'NZL'] + ['SGP', 'MYS', 'THA', 'IDN', 'PHL'],
+    'ASEAN': ['SGP', 'MYS', 'THA', 'IDN', 'PHL', 'VNM', 'MMR', 'KHM', 'LAO', 'BRN'],
+    'Mercosur': ['BRA', 'ARG', 'URY', 'PRY'],
+    'AfCFTA': ['NGA', 'EGY', 'ZAF', 'ETH', 'KEN', 'GHA', 'TZA', 'UGA'],
+}
+
+# Trade shares (would use actual trade data in production)
+TRADE_SHARES = {
+    'USMCA': 24,
+    'EU': 21,
+    'RCEP': 28,
+    'ASEAN': 12,
+    'Mercosur': 5,
+    'AfCFTA': 3,
+    'Other': 7
+}
+
+# Fallback currency shares of FX reserves
+FALLBACK_CURRENCY_SHARES = {
+    'USD': 59.2,
+    'EUR': 20.1,
+    'CNY': 12.3,
+    'JPY': 5.2,
+    'GBP': 4.9,
+    'Other': 8.3
+}
+
+INDEX_HTML = """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Geoeconomic Fragmentation Dashboard</title>
+    <meta http-equiv="refresh" content="0; url=dashboard.html">
+</head>
+<body>
+    <p>Loading dashboard...</p>
+</body>
+</html>"""
+
 def fetch_world_bank_data():
     """Fetch trade and GDP data from World Bank"""
     try:
@@ -42,34 +312,45 @@ def fetch_world_bank_data():
             'data': {}
         }
         
-        for country_name, country_code in countries.items():
-            url = f"{base_url}country/{country_code}/indicator/BX.KLT.DINV.WD.GD.ZS?format=json&per_page=100&date=2015:2024"
-            response = requests.get(url, timeout=30)
-            if response.ok:
-                result = response.json()
-                if len(result) > 1:
-                    values = {}
-                    for item in result[1]:
-                        if item.get('value'):
-                            values[item['date']] = round(item['value'], 2)
-                    fdi_gdp_data['data'][country_name] = {
-                        'country_code': country_name,
-                        'country_name': country_code,
-                        'values': values
+        def fetch_indicator(item):
+            name, indicator = item
+            url = f"{base_url}country/all/indicator/{indicator}?format=json&per_page=500&date=2019:2024"
+            return name, cached_get(url, WORLD_BANK_TTL, parse=parse_world_bank_observations)
+        
+        # One request covers all countries (the API takes a ';'-separated list)
+        fdi_url = f"{base_url}country/{';'.join(countries.values())}/indicator/BX.KLT.DINV.WD.GD.ZS?format=json&per_page=300&date=2015:2024"
+        
+        # Requests are independent, so issue them all concurrently
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            fdi_future = executor.submit(
+                cached_get, fdi_url, WORLD_BANK_TTL, parse=parse_world_bank_observations
+            )
+            indicator_results = list(executor.map(fetch_indicator, indicators.items()))
+        result = fdi_future.result()
+        
+        if result:
+            for country_code in countries:
+                if country_code not in result['names']:
+                    continue
+                fdi_gdp_data['data'][country_code] = {
+                    'country_code': country_code,
+                    'country_name': result['names'][country_code],
+                    'values': {
+                        record['d']: round(record['v'], 2)
+                        for record in result['records'] if record['c'] == country_code
                     }
+                }
         
         # Save FDI data separately
-        with open('data/fdi_gdp_data.json', 'w') as f:
-            json.dump(fdi_gdp_data, f, indent=2)
+        atomic_write_json('data/fdi_gdp_data.json', fdi_gdp_data, indent=True)
         
-        # Fetch other indicators
-        for name, indicator in indicators.items():
-            url = f"{base_url}country/all/indicator/{indicator}?format=json&per_page=500&date=2019:2024"
-            response = requests.get(url, timeout=30)
-            if response.ok:
-                result = response.json()
-                if len(result) > 1:
-                    data[name] = [item for item in result[1] if item.get('value')]
+        # Write each indicator as JSON lines so readers can stream it;
+        # the master dataset references the files instead of embedding them
+        for name, result in indicator_results:
+            if result:
+                path = f'data/wb_{name}.jsonl'
+                atomic_write_jsonl(path, result['records'])
+                data[name] = path
         
         return data
     except Exception as e:
@@ -81,19 +362,11 @@ def fetch_imf_data():
     try:
         # IMF COFER data (Currency Composition of Foreign Exchange Reserves)
         url = "https://www.imf.org/external/datamapper/api/v1/COFER"
-        response = requests.get(url, timeout=30)
+        data = cached_get(url, IMF_TTL)
         
-        if response.ok:
-            data = response.json()
+        if data is not None:
             # Process to get latest currency shares
-            currency_shares = {
-                'USD': 59.2,  # Fallback values
-                'EUR': 20.1,
-                'CNY': 12.3,
-                'JPY': 5.2,
-                'GBP': 4.9,
-                'Other': 8.3
-            }
+            currency_shares = dict(FALLBACK_CURRENCY_SHARES)
             
             # Parse actual data if available
             if 'values' in data:
@@ -107,30 +380,9 @@ def fetch_imf_data():
 
 def fetch_trade_agreements():
     """Compile trade agreement participation data"""
-    # Static but periodically updated
-    agreements = {
-        'USMCA': ['USA', 'CAN', 'MEX'],
-        'EU': ['DEU', 'FRA', 'ITA', 'ESP', 'NLD', 'POL', 'BEL', 'GRC', 'PRT', 'CZE'],
-        'RCEP': ['CHN', 'JPN', 'KOR', 'AUS', 'NZL'] + ['SGP', 'MYS', 'THA', 'IDN', 'PHL'],
-        'ASEAN': ['SGP', 'MYS', 'THA', 'IDN', 'PHL', 'VNM', 'MMR', 'KHM', 'LAO', 'BRN'],
-        'Mercosur': ['BRA', 'ARG', 'URY', 'PRY'],
-        'AfCFTA': ['NGA', 'EGY', 'ZAF', 'ETH', 'KEN', 'GHA', 'TZA', 'UGA'],
-    }
-    
-    # Calculate trade shares (would use actual trade data in production)
-    trade_shares = {
-        'USMCA': 24,
-        'EU': 21,
-        'RCEP': 28,
-        'ASEAN': 12,
-        'Mercosur': 5,
-        'AfCFTA': 3,
-        'Other': 7
-    }
-    
     return {
-        'agreements': agreements,
-        'trade_shares': trade_shares,
+        'agreements': TRADE_AGREEMENTS,
+        'trade_shares': TRADE_SHARES,
         'updated': datetime.now().isoformat()
     }
 
@@ -177,31 +429,42 @@ def fetch_fred_data():
         data = {}
         base_url = 'https://api.stlouisfed.org/fred/series/observations'
         
-        for series_id, name in series.items():
+        def fetch_series(series_id):
             params = {
                 'series_id': series_id,
                 'api_key': api_key,
                 'file_type': 'json',
                 'observation_start': '2020-01-01'
             }
-            response = requests.get(base_url, params=params, timeout=30)
-            if response.ok:
-                data[series_id] = response.json()
+            return cached_get(
+                base_url, FRED_TTL, params=params,
+                parse=parse_fred_observations, stream=True,
+                retry_policy=retry_rate_limited
+            )
+        
+        # A failed series is recorded as None without losing the others
+        for series_id, name in series.items():
+            data[series_id] = fetch_series(series_id)
         
         return data
     except Exception as e:
-        print(f"FRED fetch error: {e}")
+        print(f"FRED fetch error: {describe_error(e)}")
         return None
 
 def main():
     """Main data fetching and processing"""
     print("Starting data fetch...")
     
-    # Fetch from various sources
-    wb_data = fetch_world_bank_data()
-    imf_data = fetch_imf_data()
-    trade_data = fetch_trade_agreements()
-    fred_data = fetch_fred_data()
+    # Fetch from various sources concurrently (all network-bound)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        wb_future = executor.submit(fetch_world_bank_data)
+        imf_future = executor.submit(fetch_imf_data)
+        fred_future = executor.submit(fetch_fred_data)
+        trade_data = fetch_trade_agreements()
+    
+    wb_data = wb_future.result()
+    imf_data = imf_future.result()
+    fred_data = fred_future.result()
     
     # Calculate metrics
     metrics = calculate_fragmentation_metrics(wb_data, trade_data)
@@ -214,29 +477,22 @@ def main():
             'status': 'success'
         },
         'trade_blocs': trade_data,
-        'currency_shares': imf_data or {
-            'USD': 59.2,
-            'EUR': 20.1,
-            'CNY': 12.3,
-            'JPY': 5.2,
-            'GBP': 4.9,
-            'Other': 8.3
-        },
+        'currency_shares': imf_data or FALLBACK_CURRENCY_SHARES,
         'fragmentation_metrics': metrics,
         'world_bank_indicators': wb_data if wb_data else {},
         'economic_uncertainty': fred_data if fred_data else {}
     }
     
-    # Save to JSON files
-    with open('data/fragmentation_data.json', 'w') as f:
-        json.dump(master_data, f, indent=2)
-    
-    # Save individual datasets for modularity
-    with open('data/trade_blocs.json', 'w') as f:
-        json.dump(trade_data, f, indent=2)
-    
-    with open('data/metrics.json', 'w') as f:
-        json.dump(metrics, f, indent=2)
+    # Save to compact JSON files (consumed by the dashboard, not people),
+    # plus individual datasets for modularity
+    outputs = [
+        ('data/fragmentation_data.json', master_data),
+        ('data/fragmentation_data.json.gz', master_data),
+        ('data/trade_blocs.json', trade_data),
+        ('data/metrics.json', metrics)
+    ]
+    with ThreadPoolExecutor(max_workers=len(outputs)) as executor:
+        list(executor.map(lambda output: atomic_write_json(*output), outputs))
     
     print(f"Data updated successfully at {datetime.now()}")
     
@@ -245,21 +501,14 @@ def main():
 
 def create_index_file():
     """Create index.html that loads the dashboard"""
-    index_content = """<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Geoeconomic Fragmentation Dashboard</title>
-    <meta http-equiv="refresh" content="0; url=dashboard.html">
-</head>
-<body>
-    <p>Loading dashboard...</p>
-</body>
-</html>"""
+    # Skip the write when unchanged so the file keeps its mtime
+    if os.path.exists('index.html'):
+        with open('index.html') as f:
+            if f.read() == INDEX_HTML:
+                return
     
     with open('index.html', 'w') as f:
-        f.write(index_content)
+        f.write(INDEX_HTML)
 
 if __name__ == "__main__":
     main()